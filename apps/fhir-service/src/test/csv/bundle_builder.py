@@ -0,0 +1,341 @@
+"""Shared helpers for generating the terminology master-data bundles from CSV exports"""
+
+import csv
+import functools
+import itertools
+import json
+import os
+import re
+import tempfile
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+except ImportError:
+    pacsv = None
+
+def read_columns_with_pyarrow(csv_file):
+    """Read the code and display columns with pyarrow's multithreaded CSV parser"""
+    
+    # Use generated column names so the string types below always apply (even with
+    # a BOM) and codes such as "0213" keep their leading zeros; the header is read
+    # as a data row and sliced off, which also keeps header-only files working
+    table = pacsv.read_csv(
+        csv_file,
+        read_options=pacsv.ReadOptions(autogenerate_column_names=True),
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(column_types={'f0': pa.string(), 'f1': pa.string()})
+    ).slice(1)
+    # pyarrow keeps CRLF inside quoted multi-line values; normalize them to LF like
+    # the text-mode csv module does
+    codes, displays = (pc.replace_substring(table.column(i), '\r\n', '\n') for i in (0, 1))
+    return codes.to_pylist(), displays.to_pylist()
+
+def read_code_display_columns(csv_file):
+    """Read the code and display columns (the first two CSV columns) as lists of strings"""
+    
+    if pacsv is not None:
+        try:
+            return read_columns_with_pyarrow(csv_file)
+        except pa.ArrowInvalid:
+            # pyarrow rejects rows with fewer fields than the header, which the csv
+            # module accepts; parse such files with the reader below instead
+            pass
+    
+    with open(csv_file, 'rb') as file:
+        lines = file.read().decode('utf-8-sig').split('\n')
+    # A trailing newline leaves an empty last element, which must not be fed to
+    # csv.reader as an extra continuation line of an unterminated quoted value
+    if lines and not lines[-1]:
+        lines.pop()
+    lines = iter(lines)
+    
+    # Skip the header, ignoring any blank lines before it as pyarrow and csv do
+    for header in lines:
+        if header.rstrip('\r'):
+            break
+    
+    codes = []
+    displays = []
+    for line in lines:
+        line = line.rstrip('\r')
+        if not line:
+            continue
+        fields = line.split(',', 2)
+        if is_simple_csv_row(fields):
+            code = fields[0]
+            if code[:1] == '"':
+                code = code[1:-1]
+            display = fields[1]
+        else:
+            # Embedded commas, escaped quotes or multi-line values: let the csv
+            # module parse this record, pulling continuation lines as needed
+            record = itertools.chain(
+                (line + '\n',), (continuation.rstrip('\r') + '\n' for continuation in lines)
+            )
+            row = next(csv.reader(record))
+            code, display = row[0], row[1] if len(row) > 1 else ''
+        codes.append(code)
+        displays.append(display)
+    
+    return codes, displays
+
+def is_simple_csv_row(fields):
+    """Check whether a row split naively on commas parses the same as with full CSV quoting rules"""
+    if len(fields) < 2 or '"' in fields[1] or (len(fields) > 2 and '"' in fields[2]):
+        return False
+    code = fields[0]
+    if '"' not in code:
+        return True
+    return len(code) >= 2 and code[0] == '"' and code[-1] == '"' and '"' not in code[1:-1]
+
+if msgspec is not None:
+    class CodeSystemConcept(msgspec.Struct):
+        """CodeSystem concept, encoded by msgspec without building a dict per concept"""
+        code: str
+        display: str
+        definition: str
+    
+    class ValueSetConcept(msgspec.Struct):
+        """ValueSet compose.include concept"""
+        code: str
+        display: str
+    
+    msgspec_encoder = msgspec.json.Encoder()
+
+class ConceptView:
+    """Concept array backed by the shared code/display columns, yielding one concept at a time
+    
+    Concepts are msgspec structs when msgspec is installed and plain dicts otherwise.
+    """
+    
+    __slots__ = ('codes', 'displays', 'definition_prefix')
+    
+    def __init__(self, codes, displays, definition_prefix=None):
+        self.codes = codes
+        self.displays = displays
+        self.definition_prefix = definition_prefix
+    
+    def __len__(self):
+        return len(self.codes)
+    
+    def __iter__(self):
+        prefix = self.definition_prefix
+        pairs = zip(self.codes, self.displays)
+        if msgspec is not None:
+            if prefix is None:
+                return (ValueSetConcept(code, display) for code, display in pairs)
+            return (CodeSystemConcept(code, display, f"{prefix}: {display}") for code, display in pairs)
+        if prefix is None:
+            return ({"code": code, "display": display} for code, display in pairs)
+        return ({"code": code, "display": display, "definition": f"{prefix}: {display}"} for code, display in pairs)
+
+# Bounds for the output file buffer
+MIN_WRITE_BUFFER = 64 * 1024
+MAX_WRITE_BUFFER = 16 * 1024 * 1024
+
+# Mode a plain open() would give the bundle under the current umask
+UMASK = os.umask(0)
+os.umask(UMASK)
+DEFAULT_FILE_MODE = 0o666 & ~UMASK
+
+# Placeholders substituted while streaming a bundle
+COUNT_SLOT = "__COUNT__"
+CONCEPTS_SLOT = "__CONCEPTS__"
+VS_CONCEPTS_SLOT = "__VS_CONCEPTS__"
+SLOT_PATTERN = re.compile(rb'"(?:__COUNT__|__CONCEPTS__|__VS_CONCEPTS__)"')
+
+def create_bundle_envelope(bundle_name, code_system_info, value_set_info, count, concepts, vs_concepts):
+    """Create the FHIR transaction bundle holding the CodeSystem and ValueSet resources"""
+    
+    return {
+        "resourceType": "Bundle",
+        "type": "transaction",
+        "entry": [
+            {
+                "fullUrl": f"urn:uuid:{bundle_name}-codesystem",
+                "resource": {
+                    "resourceType": "CodeSystem",
+                    "id": bundle_name,
+                    "url": f"http://terminology.hl7.org/CodeSystem/{bundle_name}",
+                    "identifier": [
+                        {
+                            "system": "urn:ietf:rfc:3986",
+                            "value": code_system_info["oid"]
+                        }
+                    ],
+                    "version": "1.0.0",
+                    "name": code_system_info["name"],
+                    "title": code_system_info["title"],
+                    "status": "active",
+                    "experimental": False,
+                    "date": "2025-08-05",
+                    "publisher": "FHIR Service",
+                    "description": code_system_info["description"],
+                    "caseSensitive": True,
+                    "valueSet": f"http://terminology.hl7.org/ValueSet/{bundle_name}",
+                    "content": "complete",
+                    "count": count,
+                    "concept": concepts
+                },
+                "request": {
+                    "method": "POST",
+                    "url": "CodeSystem"
+                }
+            },
+            {
+                "fullUrl": f"urn:uuid:{bundle_name}-valueset",
+                "resource": {
+                    "resourceType": "ValueSet",
+                    "id": f"{bundle_name}-vs",
+                    "url": f"http://terminology.hl7.org/ValueSet/{bundle_name}",
+                    "identifier": [
+                        {
+                            "system": "urn:ietf:rfc:3986",
+                            "value": value_set_info["oid"]
+                        }
+                    ],
+                    "version": "1.0.0",
+                    "name": value_set_info["name"],
+                    "title": value_set_info["title"],
+                    "status": "active",
+                    "experimental": False,
+                    "date": "2025-08-05",
+                    "publisher": "FHIR Service",
+                    "description": value_set_info["description"],
+                    "purpose": value_set_info["purpose"],
+                    "compose": {
+                        "include": [
+                            {
+                                "system": f"http://terminology.hl7.org/CodeSystem/{bundle_name}",
+                                "concept": vs_concepts
+                            }
+                        ]
+                    }
+                },
+                "request": {
+                    "method": "POST",
+                    "url": "ValueSet"
+                }
+            }
+        ]
+    }
+
+def dumps(obj, pretty=False):
+    """Encode obj as UTF-8 JSON (compact, or 2-space indented when pretty)
+    
+    msgspec is preferred, then orjson; all backends produce the same layout. The stdlib
+    fallback keeps ensure_ascii on, which takes json's fast C escaping path for the
+    mostly-ASCII terminology; non-ASCII displays come out as \\uXXXX escapes there.
+    """
+    if msgspec is not None:
+        encoded = msgspec_encoder.encode(obj)
+        return msgspec.json.format(encoded, indent=2) if pretty else encoded
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+    if pretty:
+        return json.dumps(obj, indent=2).encode('ascii')
+    return json.dumps(obj, separators=(',', ':')).encode('ascii')
+
+def line_indent(encoded, pos):
+    """Return the leading whitespace of the line containing encoded[pos]"""
+    line = encoded[encoded.rfind(b'\n', 0, pos) + 1:pos]
+    return line[:len(line) - len(line.lstrip(b' '))]
+
+def write_concept_array(f, concepts, indent=None):
+    """Write a JSON array one encoded concept at a time, nested at the given indent (None for compact output)"""
+    
+    separator = b'['
+    if indent is None:
+        for concept in concepts:
+            f.write(separator + dumps(concept))
+            separator = b','
+        f.write(b'[]' if separator == b'[' else b']')
+        return
+    
+    # Encoded JSON never contains a raw newline inside a string, so re-indenting
+    # each concept is a plain byte replace
+    newline = b'\n' + indent + b'  '
+    for concept in concepts:
+        f.write(separator + newline + dumps(concept, pretty=True).replace(b'\n', newline))
+        separator = b','
+    f.write(b'[]' if separator == b'[' else b'\n' + indent + b']')
+
+def freeze_info(info):
+    """Convert a code system / value set info dict into a hashable cache key"""
+    return tuple(sorted(info.items()))
+
+def build_templates(bundle_name, code_system_info, value_set_info, pretty=False):
+    """Pre-encode the static parts of a bundle as (head, prefix, mid, suffix) bytes
+    
+    The bundle is written as head + count + prefix + concepts + mid + vs_concepts + suffix.
+    Templates are cached per bundle, so regenerating a bundle in the same process reuses them.
+    """
+    return _build_templates(bundle_name, freeze_info(code_system_info), freeze_info(value_set_info), pretty)
+
+@functools.lru_cache(maxsize=None)
+def _build_templates(bundle_name, code_system_items, value_set_items, pretty):
+    envelope = dumps(create_bundle_envelope(
+        bundle_name, dict(code_system_items), dict(value_set_items), COUNT_SLOT, CONCEPTS_SLOT, VS_CONCEPTS_SLOT
+    ), pretty)
+    head, prefix, mid, suffix = SLOT_PATTERN.split(envelope)
+    return head, prefix, mid, suffix
+
+def write_bundle_stream(f, templates, definition_prefix, codes, displays, pretty=False):
+    """Write a complete bundle to the binary file f without materializing the concept arrays"""
+    
+    head, prefix, mid, suffix = templates
+    concepts_indent = line_indent(prefix, len(prefix)) if pretty else None
+    vs_concepts_indent = line_indent(mid, len(mid)) if pretty else None
+    
+    f.write(head)
+    f.write(str(len(codes)).encode())
+    f.write(prefix)
+    write_concept_array(f, ConceptView(codes, displays, definition_prefix), concepts_indent)
+    f.write(mid)
+    write_concept_array(f, ConceptView(codes, displays), vs_concepts_indent)
+    f.write(suffix)
+
+def write_complete_bundle(csv_file, output_file, bundle_name, code_system_info, value_set_info, pretty=False):
+    """Write a complete FHIR bundle with all concepts from CSV, returning the concept count
+    
+    Output is compact JSON since the bundles are loaded by the FHIR service; pass
+    pretty=True for 2-space indented output meant for people. The bundle is written to a
+    temporary file first, so readers never see a partially written bundle.
+    """
+    
+    templates = build_templates(bundle_name, code_system_info, value_set_info, pretty)
+    codes, displays = read_code_display_columns(csv_file)
+    
+    # Bundles come out at roughly 3-4x the CSV size; a buffer sized from the CSV lets
+    # small and medium bundles go out in a single flush
+    buffering = min(max(MIN_WRITE_BUFFER, os.path.getsize(csv_file) * 3), MAX_WRITE_BUFFER)
+    
+    # Each writer gets its own temporary file, so concurrent runs never interleave
+    f = tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(output_file) or '.', suffix='.tmp', delete=False, buffering=buffering
+    )
+    tmp_file = f.name
+    try:
+        with f:
+            write_bundle_stream(f, templates, code_system_info['definition_prefix'], codes, displays, pretty)
+        # NamedTemporaryFile creates the file as 0600; give the bundle the usual mode
+        os.chmod(tmp_file, DEFAULT_FILE_MODE)
+        os.replace(tmp_file, output_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    
+    return len(codes)
@@ -1,116 +1,10 @@
-import csv
-import json
+import argparse
+import concurrent.futures
+import itertools
 import os
-from datetime import datetime
+import sys
 
-def create_complete_bundle(csv_file, bundle_name, code_system_info, value_set_info):
-    """Create a complete FHIR bundle with all concepts from CSV"""
-    
-    # Read CSV data
-    concepts = []
-    vs_concepts = []
-    
-    with open(csv_file, 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            # Get the field names (first two columns)
-            fields = list(row.keys())
-            code_field = fields[0]
-            display_field = fields[1]
-            
-            code = row[code_field].strip('"')
-            display = row[display_field].strip('"')
-            
-            # CodeSystem concept
-            concept = {
-                "code": code,
-                "display": display,
-                "definition": f"{code_system_info['definition_prefix']}: {display}"
-            }
-            concepts.append(concept)
-            
-            # ValueSet concept
-            vs_concept = {
-                "code": code,
-                "display": display
-            }
-            vs_concepts.append(vs_concept)
-    
-    # Create the bundle
-    bundle = {
-        "resourceType": "Bundle",
-        "type": "transaction",
-        "entry": [
-            {
-                "fullUrl": f"urn:uuid:{bundle_name}-codesystem",
-                "resource": {
-                    "resourceType": "CodeSystem",
-                    "id": bundle_name,
-                    "url": f"http://terminology.hl7.org/CodeSystem/{bundle_name}",
-                    "identifier": [
-                        {
-                            "system": "urn:ietf:rfc:3986",
-                            "value": code_system_info["oid"]
-                        }
-                    ],
-                    "version": "1.0.0",
-                    "name": code_system_info["name"],
-                    "title": code_system_info["title"],
-                    "status": "active",
-                    "experimental": False,
-                    "date": "2025-08-05",
-                    "publisher": "FHIR Service",
-                    "description": code_system_info["description"],
-                    "caseSensitive": True,
-                    "valueSet": f"http://terminology.hl7.org/ValueSet/{bundle_name}",
-                    "content": "complete",
-                    "count": len(concepts),
-                    "concept": concepts
-                },
-                "request": {
-                    "method": "POST",
-                    "url": "CodeSystem"
-                }
-            },
-            {
-                "fullUrl": f"urn:uuid:{bundle_name}-valueset",
-                "resource": {
-                    "resourceType": "ValueSet",
-                    "id": f"{bundle_name}-vs",
-                    "url": f"http://terminology.hl7.org/ValueSet/{bundle_name}",
-                    "identifier": [
-                        {
-                            "system": "urn:ietf:rfc:3986",
-                            "value": value_set_info["oid"]
-                        }
-                    ],
-                    "version": "1.0.0",
-                    "name": value_set_info["name"],
-                    "title": value_set_info["title"],
-                    "status": "active",
-                    "experimental": False,
-                    "date": "2025-08-05",
-                    "publisher": "FHIR Service",
-                    "description": value_set_info["description"],
-                    "purpose": value_set_info["purpose"],
-                    "compose": {
-                        "include": [
-                            {
-                                "system": f"http://terminology.hl7.org/CodeSystem/{bundle_name}",
-                                "concept": vs_concepts
-                            }
-                        ]
-                    }
-                },
-                "request": {
-                    "method": "POST",
-                    "url": "ValueSet"
-                }
-            }
-        ]
-    }
-    
-    return bundle
+from bundle_builder import write_complete_bundle
 
 # Configuration for all bundles
 bundle_configs = {
@@ -286,29 +180,55 @@ bundle_configs = {
     }
 }
 
-# Generate all bundles
-for csv_file, config in bundle_configs.items():
-    if os.path.exists(csv_file):
-        try:
-            bundle = create_complete_bundle(
-                csv_file, 
-                config["bundle_name"], 
-                config["code_system"], 
-                config["value_set"]
-            )
-            
-            # Save to file
-            output_file = f"../master-data/{config['bundle_name']}-bundle.json"
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(bundle, f, indent=4, ensure_ascii=False)
-            
-            concept_count = len(bundle['entry'][0]['resource']['concept'])
-            print(f"✓ {csv_file}: Generated complete bundle with {concept_count:,} concepts")
-            print(f"  Saved to: {config['bundle_name']}-bundle.json")
-            
-        except Exception as e:
-            print(f"✗ {csv_file}: Error - {str(e)}")
-    else:
-        print(f"✗ {csv_file}: File not found")
+def process_one(csv_file, config, pretty=False):
+    """Generate the bundle for one CSV file and return its status message"""
+    
+    try:
+        output_file = f"../master-data/{config['bundle_name']}-bundle.json"
+        concept_count = write_complete_bundle(
+            csv_file, 
+            output_file, 
+            config["bundle_name"], 
+            config["code_system"], 
+            config["value_set"], 
+            pretty
+        )
+        
+        return (
+            f"✓ {csv_file}: Generated complete bundle with {concept_count:,} concepts\n"
+            f"  Saved to: {config['bundle_name']}-bundle.json"
+        )
+        
+    except Exception as e:
+        return f"✗ {csv_file}: Error - {str(e)}"
 
-print(f"\nGeneration complete! All bundles now contain complete data with explicit ValueSet concepts.")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate complete terminology bundles from all CSV files")
+    parser.add_argument("--pretty", action="store_true", help="write indented JSON instead of compact JSON")
+    args = parser.parse_args()
+    
+    # Status lines are collected and written to stderr in one go at the end
+    log_lines = []
+    
+    # List the directory once instead of checking each CSV separately
+    present = {entry.name for entry in os.scandir('.')}
+    available = {csv_file: config for csv_file, config in bundle_configs.items() if csv_file in present}
+    for csv_file in bundle_configs:
+        if csv_file not in available:
+            log_lines.append(f"✗ {csv_file}: File not found")
+    
+    # Generate all bundles; each CSV is independent, so they run in parallel. The
+    # collected lines are flushed even if the pool breaks or the run is interrupted
+    max_workers = max(1, min(len(available), os.cpu_count() or 1))
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                process_one, available.keys(), available.values(), itertools.repeat(args.pretty)
+            )
+            for message in results:
+                log_lines.append(message)
+        
+        log_lines.append("")
+        log_lines.append("Generation complete! All bundles now contain complete data with explicit ValueSet concepts.")
+    finally:
+        sys.stderr.write("\n".join(log_lines) + "\n")
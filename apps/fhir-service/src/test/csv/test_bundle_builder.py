@@ -0,0 +1,216 @@
+"""Checks the bundle CSV readers against the csv module and the streamed bundle JSON
+
+Run from this directory with: python -m unittest test_bundle_builder
+"""
+
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import bundle_builder
+
+
+def reference_columns(csv_file):
+    """Code and display columns as parsed by a text-mode csv.reader"""
+    with open(csv_file, 'r', encoding='utf-8-sig') as file:
+        rows = [row for row in csv.reader(file) if row][1:]
+    return [row[0] for row in rows], [row[1] if len(row) > 1 else '' for row in rows]
+
+
+class ReadCodeDisplayColumnsTest(unittest.TestCase):
+    """Compares read_code_display_columns against csv.reader for every available backend"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def write_csv(self, text, bom=False):
+        path = os.path.join(self.tmp_dir.name, 'concepts.csv')
+        with open(path, 'wb') as f:
+            f.write((b'\xef\xbb\xbf' if bom else b'') + text.encode('utf-8'))
+        return path
+
+    def backends(self):
+        yield 'stdlib', mock.patch.object(bundle_builder, 'pacsv', None)
+        if bundle_builder.pacsv is not None:
+            yield 'pyarrow', mock.patch.object(bundle_builder, 'pacsv', bundle_builder.pacsv)
+
+    def assertMatchesCsvModule(self, text, bom=False):
+        path = self.write_csv(text, bom)
+        expected = reference_columns(path)
+        for name, patch in self.backends():
+            with self.subTest(backend=name), patch:
+                self.assertEqual(bundle_builder.read_code_display_columns(path), expected)
+
+    def test_quoted_codes_keep_leading_zeros(self):
+        self.assertMatchesCsvModule('"CODE","NAME"\n"0213",Foo\n"0100",Bar\n')
+
+    def test_bom_header(self):
+        self.assertMatchesCsvModule('"CODE","NAME"\n"0213",Foo\n"0100",Bar\n', bom=True)
+
+    def test_header_only(self):
+        self.assertMatchesCsvModule('"CODE","NAME"\n')
+
+    def test_embedded_commas_and_doubled_quotes(self):
+        self.assertMatchesCsvModule(
+            '"CODE","NAME"\n'
+            '"1","Tablet, film coated"\n'
+            '"2","LCD Screen 19"""\n'
+            '"3,4",Plain\n'
+            '5,"""S"" Hooks, Qty 10"\n'
+        )
+
+    def test_multi_line_values(self):
+        self.assertMatchesCsvModule(
+            '"CODE","NAME","SHORT"\n'
+            '"1","PIGGYBACK CABINET 64 L\n ""WITH ONE SHELF""",PC\n'
+            '"2",Kit,"first\nsecond, third"\n'
+            '"3",After,AF\n'
+        )
+
+    def test_crlf_line_endings(self):
+        self.assertMatchesCsvModule(
+            '"CODE","NAME","SHORT"\r\n'
+            '"1",Plain,P\r\n'
+            '"2","a\r\nb\r\nc",X\r\n'
+            '"3",Kit,"first\r\nsecond"\r\n'
+            '"4",After,AF\r\n'
+        )
+
+    def test_blank_lines_before_header(self):
+        self.assertMatchesCsvModule('\n\r\n"CODE","NAME"\n"1",Foo\n')
+        self.assertMatchesCsvModule('\n"CODE","NAME"\n"1",Foo\n', bom=True)
+
+    def test_unterminated_quote_at_end_of_file(self):
+        self.assertMatchesCsvModule('"CODE","NAME"\n1,"abc\n')
+        self.assertMatchesCsvModule('"CODE","NAME"\r\n1,"abc\r\n')
+
+    def test_unquoted_codes_three_columns_and_blank_lines(self):
+        self.assertMatchesCsvModule(
+            '"DEPARTMENTID","DEPARTMENTNAME","DEPARTMENTCODE"\n'
+            '292,RESPIRATORY CLINIC,C-RES\n'
+            '\n'
+            '293,GC - PATIENT EDUCATION Clinic ,C-GPE\n'
+        )
+
+    def test_short_rows(self):
+        self.assertMatchesCsvModule(
+            '"CODE","NAME","SHORT"\n'
+            '1,a\n'
+            '2,b,c\n'
+            '"3","x\ny"\n'
+            '4\n'
+        )
+
+    def test_random_exports(self):
+        alphabet = 'ab 0,"\né'
+        rng = random.Random(1234)
+        for case in range(200):
+            out = io.StringIO()
+            writer = csv.writer(out, lineterminator=rng.choice(['\n', '\r\n']))
+            columns = rng.choice([2, 3])
+            writer.writerow(['CODE', 'NAME', 'SHORT'][:columns])
+            for _ in range(rng.randint(0, 5)):
+                writer.writerow(
+                    [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 6))) for _ in range(columns)]
+                )
+            with self.subTest(case=case):
+                self.assertMatchesCsvModule(out.getvalue(), bom=rng.random() < 0.2)
+
+
+class WriteCompleteBundleTest(unittest.TestCase):
+    """Checks the streamed bundle JSON for every available encoder, compact and pretty"""
+
+    code_system_info = {
+        "oid": "urn:oid:1.2.3",
+        "name": "Test",
+        "title": "Test Concepts",
+        "description": "Test code system",
+        "definition_prefix": "Test concept"
+    }
+    value_set_info = {
+        "oid": "urn:oid:1.2.4",
+        "name": "TestVS",
+        "title": "Test Concepts Value Set",
+        "description": "Test value set",
+        "purpose": "Testing"
+    }
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def encoders(self):
+        """Yield (name, module overrides) for each encoder that can run here"""
+        if bundle_builder.msgspec is not None:
+            yield 'msgspec', {'msgspec': bundle_builder.msgspec}
+        if bundle_builder.orjson is not None:
+            yield 'orjson', {'msgspec': None}
+        yield 'stdlib', {'msgspec': None, 'orjson': None}
+
+    def expected_bundle(self, pairs):
+        prefix = self.code_system_info['definition_prefix']
+        concepts = [{"code": code, "display": display, "definition": f"{prefix}: {display}"} for code, display in pairs]
+        vs_concepts = [{"code": code, "display": display} for code, display in pairs]
+        return bundle_builder.create_bundle_envelope(
+            'test', self.code_system_info, self.value_set_info, len(pairs), concepts, vs_concepts
+        )
+
+    def assertWritesBundle(self, csv_text, pairs):
+        csv_file = os.path.join(self.tmp_dir.name, 'concepts.csv')
+        output_file = os.path.join(self.tmp_dir.name, 'test-bundle.json')
+        with open(csv_file, 'w', encoding='utf-8', newline='') as f:
+            f.write(csv_text)
+        expected = self.expected_bundle(pairs)
+
+        for name, overrides in self.encoders():
+            for pretty in (False, True):
+                with self.subTest(encoder=name, pretty=pretty), mock.patch.multiple(bundle_builder, **overrides):
+                    count = bundle_builder.write_complete_bundle(
+                        csv_file, output_file, 'test', self.code_system_info, self.value_set_info, pretty
+                    )
+                    with open(output_file, 'rb') as f:
+                        output = f.read()
+
+                    self.assertEqual(count, len(pairs))
+                    self.assertEqual(json.loads(output), expected)
+                    # Byte-for-byte layout matches the stdlib encoder
+                    ensure_ascii = name == 'stdlib'
+                    if pretty:
+                        layout = json.dumps(expected, indent=2, ensure_ascii=ensure_ascii)
+                    else:
+                        layout = json.dumps(expected, separators=(',', ':'), ensure_ascii=ensure_ascii)
+                    self.assertEqual(output, layout.encode('utf-8'))
+
+    def test_concepts(self):
+        self.assertWritesBundle(
+            '"CODE","NAME"\n"0213",Foo\n"2","LCD Screen 19"""\n"3","Caf\u00e9, multi\nline"\n',
+            [("0213", "Foo"), ("2", 'LCD Screen 19"'), ("3", "Caf\u00e9, multi\nline")]
+        )
+
+    def test_no_data_rows(self):
+        self.assertWritesBundle('"CODE","NAME"\n', [])
+
+    def test_output_replaced_without_leftover_temp_files(self):
+        csv_file = os.path.join(self.tmp_dir.name, 'concepts.csv')
+        output_file = os.path.join(self.tmp_dir.name, 'test-bundle.json')
+        with open(csv_file, 'w', encoding='utf-8') as f:
+            f.write('"CODE","NAME"\n"1",Foo\n')
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write('stale')
+
+        bundle_builder.write_complete_bundle(csv_file, output_file, 'test', self.code_system_info, self.value_set_info)
+
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), ['concepts.csv', 'test-bundle.json'])
+        self.assertEqual(os.stat(output_file).st_mode & 0o777, bundle_builder.DEFAULT_FILE_MODE)
+        with open(output_file, encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['entry'][0]['resource']['count'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()